@@ -1,91 +1,320 @@
 import pandas as pd
-import os
+import io
 import numpy as np
+from pandas.api.types import infer_dtype, is_datetime64_any_dtype
 from openpyxl import load_workbook
 from openpyxl.styles import PatternFill
 import streamlit as st
-import tempfile
-
-def extract_and_merge_columns_basic(old_file, new_file, old_keys, new_keys, old_cols, new_cols):
-    """Perform a basic merge without additional columns."""
-    # Concatenate primary keys to create unique identifiers
-    old_file['UniqueKey'] = old_file[old_keys].astype(str).agg('_'.join, axis=1)
-    new_file['UniqueKey'] = new_file[new_keys].astype(str).agg('_'.join, axis=1)
+import xlsxwriter
+from datetime import date, datetime, time
+from functools import lru_cache
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+else:
+    # DataFrame.join only accepts nulls_equal from polars 1.24 onwards
+    if tuple(int(part) for part in pl.__version__.split('.')[:2]) < (1, 24):
+        pl = None
+
+# Column selections stay views until they are written to; pandas 3 always works this way
+# and warns when the option is set
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Parsed uploads kept in server memory, shared across sessions
+CACHE_MAX_ENTRIES = 16
+
+# Datetime units from coarsest to finest
+DATETIME_UNITS = ['s', 'ms', 'us', 'ns']
+
+# Day that Excel time-only cells are anchored to
+EXCEL_EPOCH_DAY = date(1900, 1, 1)
+
+# Below this many rows converting to polars costs more than its faster join saves
+POLARS_MIN_ROWS = 50_000
+
+OUTPUT_MIME_TYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/octet-stream',
+}
+
+@lru_cache(maxsize=32)
+def _split_cols(text):
+    """Split a comma-separated input into stripped, non-empty column names."""
+    return tuple(col for col in (part.strip() for part in text.split(',')) if col)
+
+def _parse_cols(text):
+    """Return the column names of a comma-separated input as a fresh list."""
+    return list(_split_cols(text))
+
+def _with_keys(keys, cols):
+    """Return the primary keys followed by the requested columns, without repeats."""
+    return keys + [col for col in cols if col not in keys]
+
+def _join_frame(df, keys, cols):
+    """Select the output columns plus a copy of each key under a private join name."""
+    join_keys = [f'__merge_key_{idx}__' for idx in range(len(keys))]
+    data = df.loc[:, list(dict.fromkeys(cols))]
+    for join_key, key in zip(join_keys, keys):
+        data[join_key] = df[key]
+    # Keep the first row per key, which makes the join one-to-one,
+    # so it can never emit more rows than the smaller input
+    return data.drop_duplicates(subset=join_keys), join_keys
+
+def _align_key_dtypes(old_data, new_data, old_keys, new_keys):
+    """Convert key pairs to strings unless both sides already share a non-object dtype."""
+    # Mixed object columns can hold 1 on one side and '1' on the other, so they are
+    # normalized too, matching the str-based keys the merge originally used
+    for old_key, new_key in zip(old_keys, new_keys):
+        old_dtype = old_data[old_key].dtype
+        if old_dtype != new_data[new_key].dtype or old_dtype == object:
+            old_data[old_key] = old_data[old_key].astype('string')
+            new_data[new_key] = new_data[new_key].astype('string')
+
+def _polars_merge(old_data, new_data, old_keys, new_keys):
+    """Inner-join two frames with key-unique rows using polars, shaped like pd.merge's result."""
+    # Join only the keys and row positions in polars; nulls match like they do in pandas
+    old_rows = pl.from_pandas(old_data.loc[:, old_keys].reset_index(drop=True)).with_row_index('_old_row')
+    new_rows = pl.from_pandas(new_data.loc[:, new_keys].reset_index(drop=True)).with_row_index('_new_row')
+    pairs = (
+        old_rows.join(new_rows, left_on=old_keys, right_on=new_keys, how='inner', nulls_equal=True)
+        .select('_old_row', '_new_row')
+        .sort('_old_row')
+    )
 
-    # Extract specified columns from old and new files
-    old_data = old_file[['UniqueKey'] + old_cols]
-    new_data = new_file[['UniqueKey'] + new_cols]
+    # Assemble the columns in pandas, dropping right keys that pandas coalesces and suffixing overlaps
+    coalesced = [new_key for old_key, new_key in zip(old_keys, new_keys) if old_key == new_key]
+    left = old_data.iloc[pairs['_old_row'].to_numpy()].reset_index(drop=True)
+    right = new_data.iloc[pairs['_new_row'].to_numpy()].reset_index(drop=True).drop(columns=coalesced)
+    overlap = left.columns.intersection(right.columns)
+    left = left.rename(columns={col: f'{col}_x' for col in overlap})
+    right = right.rename(columns={col: f'{col}_y' for col in overlap})
+    return pd.concat([left, right], axis=1)
+
+def _xlsx_cell(value):
+    """Return None for missing values so xlsxwriter leaves the cell empty."""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def write_xlsx(df, output, sheet_name='Merged'):
+    """Write a DataFrame as xlsx to a path or buffer row by row in constant memory."""
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        'remove_timezone': True,
+    })
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        # Match the header style pandas uses for to_excel
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+
+        # constant_memory only accepts rows in order, which pandas' column-wise to_excel does not do;
+        # rows are converted one at a time so no boxed copy of the whole frame is built
+        for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_idx, 0, [_xlsx_cell(value) for value in row])
+    finally:
+        workbook.close()
+
+def _parquet_safe(df):
+    """Convert object columns that mix value types to strings, which pyarrow cannot infer."""
+    mixed = [col for col in df.columns
+             if df[col].dtype == object and infer_dtype(df[col], skipna=True) in ('mixed', 'mixed-integer')]
+    if not mixed:
+        return df
+    df = df.copy(deep=False)
+    for col in mixed:
+        df[col] = df[col].astype('string')
+    return df
+
+def write_output(df, output, output_format='xlsx'):
+    """Write the merged data in the selected output format."""
+    if output_format == 'csv':
+        df.to_csv(output, index=False)
+    elif output_format == 'parquet':
+        # pyarrow dictionary-encodes the repetitive key strings by default
+        _parquet_safe(df).to_parquet(output, engine='pyarrow', compression='zstd', index=False)
+    else:
+        write_xlsx(df, output)
+
+def _extract_and_merge(old_file, new_file, old_keys, new_keys, old_cols, new_cols, output_format='xlsx', post=None):
+    """Merge the old and new files on their primary keys and serialize the result."""
+    # Extract the specified columns, joining on private copies of the primary keys so that
+    # key names never clash with output columns of the other file
+    old_data, join_keys = _join_frame(old_file, old_keys, old_cols)
+    new_data, _ = _join_frame(new_file, new_keys, new_cols)
+    _align_key_dtypes(old_data, new_data, join_keys, join_keys)
+
+    # Perform a VLOOKUP-like merge directly on the primary key columns
+    if pl is not None and max(len(old_data), len(new_data)) > POLARS_MIN_ROWS:
+        merged_data = _polars_merge(old_data, new_data, join_keys, join_keys)
+    else:
+        merged_data = pd.merge(old_data, new_data, on=join_keys, how='inner')
 
-    # Perform a VLOOKUP-like merge based on the unique identifiers
-    merged_data = pd.merge(old_data, new_data, on='UniqueKey', how='inner')
+    # The private join keys are not part of the output
+    merged_data = merged_data.drop(columns=join_keys)
 
-    # Drop duplicate rows based on the UniqueKey column
-    merged_data = merged_data.drop_duplicates(subset='UniqueKey')
+    # Let the caller add derived columns before the data is written
+    if post is not None:
+        merged_data = post(merged_data)
 
-    # Create a temporary file to save the merged data
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-        merged_file_path = temp_file.name
+    # Serialize the merged data in memory for the download button
+    buffer = io.BytesIO()
+    write_output(merged_data, buffer, output_format)
 
-    with pd.ExcelWriter(merged_file_path, engine='openpyxl') as writer:
-        merged_data.to_excel(writer, sheet_name='Merged', index=False)
+    return buffer.getvalue()
 
-    return merged_file_path
+def extract_and_merge_columns_basic(old_file, new_file, old_keys, new_keys, old_cols, new_cols, output_format='xlsx'):
+    """Perform a basic merge without additional columns."""
+    return _extract_and_merge(old_file, new_file, old_keys, new_keys, old_cols, new_cols, output_format)
+
+def read_excel_columns(uploaded_file, keys, cols):
+    """Read only the key and output columns of the first sheet in read-only mode."""
+    wanted = _with_keys(keys, cols)
+
+    # Stream the cell values without building the full workbook model
+    workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        # Ignore the stored <dimension> tag, which can be stale and cut off rows and columns
+        worksheet = workbook.worksheets[0]
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, ())
+
+        # Locate the first occurrence of each wanted column in the header row
+        positions = {}
+        for idx, name in enumerate(header):
+            if name in wanted and name not in positions:
+                positions[name] = idx
+        names = list(positions)
+        indices = list(positions.values())
+
+        data = {name: [] for name in names}
+        for row in rows:
+            for name, idx in zip(names, indices):
+                data[name].append(row[idx] if idx < len(row) else None)
+    finally:
+        workbook.close()
+
+    df = pd.DataFrame(data, columns=names)
+
+    # Drop trailing empty rows left behind by formatted but blank cells
+    non_empty = np.flatnonzero(df.notna().any(axis=1).to_numpy())
+    df = df.iloc[:non_empty[-1] + 1] if len(non_empty) else df.iloc[:0]
+
+    # Read the primary keys as strings so both files hash them the same way
+    present_keys = [key for key in keys if key in positions]
+    df[present_keys] = df[present_keys].astype('string')
+    return df
+
+def read_excel_header(uploaded_file):
+    """Read the column names from the header row of the first sheet."""
+    workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        # Ignore the stored <dimension> tag, which can be stale and cut off columns
+        worksheet = workbook.worksheets[0]
+        worksheet.reset_dimensions()
+        return next(worksheet.iter_rows(max_row=1, values_only=True), ())
+    finally:
+        workbook.close()
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_xlsx_header(file_bytes, file_name):
+    """Read an uploaded workbook's column names once per file content."""
+    return frozenset(read_excel_header(io.BytesIO(file_bytes)))
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_xlsx(file_bytes, file_name, keys, cols):
+    """Read an uploaded workbook once per file content and column selection."""
+    return read_excel_columns(io.BytesIO(file_bytes), keys, cols)
+
+def _parse_datetime_values(values):
+    """Parse an object array of cell values with one fixed convention for every column."""
+    parsed = np.full(len(values), None, dtype=object)
+
+    # Excel date cells arrive as Python objects; a bare time of day falls on Excel's
+    # 1900-01-01 epoch day, as the original '%H:%M:%S' parsing did
+    for idx, value in enumerate(values):
+        if isinstance(value, datetime):
+            parsed[idx] = value
+        elif isinstance(value, date):
+            parsed[idx] = datetime.combine(value, time())
+        elif isinstance(value, time):
+            parsed[idx] = datetime.combine(EXCEL_EPOCH_DAY, value)
+
+    # Text is read as ISO 8601, and only the entries that fail are retried day-first
+    is_text = np.array([isinstance(value, str) for value in values], dtype=bool)
+    if is_text.any():
+        text = values[is_text]
+        text_parsed = np.asarray(pd.to_datetime(text, errors='coerce', format='ISO8601').astype(object))
+        missed = pd.isna(text_parsed)
+        if missed.any():
+            retried = pd.to_datetime(text[missed], errors='coerce', format='mixed', dayfirst=True)
+            text_parsed[missed] = np.asarray(retried.astype(object))
+        parsed[is_text] = text_parsed
+
+    return pd.to_datetime(parsed, errors='coerce')
+
+def _to_datetime(col):
+    """Parse a column to a DatetimeIndex, converting each distinct value only once."""
+    # Columns that are already datetimes need no parsing at all
+    if is_datetime64_any_dtype(col):
+        return pd.DatetimeIndex(col)
+
+    codes, uniques = pd.factorize(col)
+    parsed = _parse_datetime_values(np.asarray(uniques, dtype=object))
+
+    # Missing values get code -1, which is filled with NaT
+    return parsed.take(codes, allow_fill=True, fill_value=pd.NaT)
 
 def calculate_delay_days(etb_atb_col, proforma_col):
     """Calculate the Delay Days column based on the ETB / ATB and Proforma Berth columns."""
-    # Convert ETB / ATB and Proforma Berth to datetime, assuming time format
-    etb_atb = pd.to_datetime(etb_atb_col, format='%H:%M:%S', errors='coerce')
-    proforma = pd.to_datetime(proforma_col, format='%H:%M:%S', errors='coerce')
+    # Convert ETB / ATB and Proforma Berth to full datetimes, parsing each distinct value once
+    etb_atb = _to_datetime(etb_atb_col)
+    proforma = _to_datetime(proforma_col)
 
-    # Calculate delay days as the difference in days
-    delay_days = (etb_atb - proforma).dt.total_seconds() / 86400  # Difference in days
+    # Subtract in the coarser of the two units, so far-off placeholder dates such as
+    # 9999-12-31 are never cast into a unit that cannot hold them
+    unit = min(etb_atb.unit, proforma.unit, key=DATETIME_UNITS.index)
+    diff = etb_atb.as_unit(unit) - proforma.as_unit(unit)
 
-    # Round up the delay days to the nearest whole number
-    delay_days = np.ceil(delay_days)
-    return delay_days
+    # Round up the delay days to the nearest whole number with integer ceiling division
+    per_day = np.timedelta64(1, 'D') // np.timedelta64(1, unit)
+    delay_days = (-(-diff.asi8 // per_day)).astype('float64')
 
-def calculate_delay_status(delay_days):
-    """Calculate the Delay Status based on Delay Days."""
-    if pd.isna(delay_days):
-        return np.nan
-    if -14 <= delay_days <= -1:
-        return 'Advance'
-    elif 1 <= delay_days <= 14:
-        return 'Delay'
-    else:
-        return np.nan
+    # NaT is stored as a sentinel integer, so put NaN back where either side was missing
+    delay_days[diff.isna()] = np.nan
+    return pd.Series(delay_days, index=etb_atb_col.index)
 
-def extract_and_merge_columns_with_delay(old_file, new_file, old_keys, new_keys, old_cols, new_cols):
-    """Perform merge and add Delay Days and Delay Status columns."""
-    # Concatenate primary keys to create unique identifiers
-    old_file['UniqueKey'] = old_file[old_keys].astype(str).agg('_'.join, axis=1)
-    new_file['UniqueKey'] = new_file[new_keys].astype(str).agg('_'.join, axis=1)
-
-    # Extract specified columns from old and new files
-    old_data = old_file[['UniqueKey'] + old_cols]
-    new_data = new_file[['UniqueKey'] + new_cols]
-
-    # Perform a VLOOKUP-like merge based on the unique identifiers
-    merged_data = pd.merge(old_data, new_data, on='UniqueKey', how='inner')
-
-    # Drop duplicate rows based on the UniqueKey column
-    merged_data = merged_data.drop_duplicates(subset='UniqueKey')
-
-    # Add Delay Days and Delay Status columns
+def calculate_delay_status(delay_days):
+    """Calculate the Delay Status column based on the Delay Days column."""
+    # NaN compares False against both ranges and falls through to the default
+    days = delay_days.to_numpy(dtype='float64')
+    conditions = [(days >= -14) & (days <= -1), (days >= 1) & (days <= 14)]
+    # Object choices keep the NaN default as a real NaN instead of the string 'nan'
+    choices = [np.array('Advance', dtype=object), np.array('Delay', dtype=object)]
+    status = np.select(conditions, choices, default=np.nan)
+    # Store the result as Arrow-backed strings, with NaN becoming a missing value
+    return pd.Series(pd.array(status, dtype='string[pyarrow]'), index=delay_days.index)
+
+def _add_delay(merged_data):
+    """Add the Delay Days and Delay Status columns to the merged data."""
     merged_data['Delay Days'] = calculate_delay_days(
-        merged_data['ETB / ATB'], 
+        merged_data['ETB / ATB'],
         merged_data['Proforma Berth']
     )
-    merged_data['Delay Status'] = merged_data['Delay Days'].apply(calculate_delay_status)
-
-    # Create a temporary file to save the merged data
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-        merged_file_path = temp_file.name
+    merged_data['Delay Status'] = calculate_delay_status(merged_data['Delay Days'])
+    return merged_data
 
-    with pd.ExcelWriter(merged_file_path, engine='openpyxl') as writer:
-        merged_data.to_excel(writer, sheet_name='Merged', index=False)
-
-    return merged_file_path
+def extract_and_merge_columns_with_delay(old_file, new_file, old_keys, new_keys, old_cols, new_cols, output_format='xlsx'):
+    """Perform merge and add Delay Days and Delay Status columns."""
+    return _extract_and_merge(old_file, new_file, old_keys, new_keys, old_cols, new_cols, output_format, post=_add_delay)
 
 def main():
     st.title('Vessel Schedule Reports Compile Tool (Can be use for generic use)')
@@ -106,7 +335,7 @@ def main():
     
     ---- Download merged C-Report & Berthing Report ----
     
-    **Step 7**: Click "Basic Merge" and download the file
+    **Step 7**: Click "Basic Merge" and download the file (keep the Output format on `xlsx` so it can be uploaded again in Step 8)
     
     ---- Upload the files 2nd batch for merging ----
     
@@ -132,35 +361,45 @@ def main():
     old_columns = st.text_input("Enter Column names (include primary keys) to extract from Excel A (separated by commas & no space)", "Column1,Column2..etc")
     new_columns = st.text_input("Enter Column names to extract from Excel B (separated by commas & no space)", "Column1,Column2..etc")
 
+    # CSV and Parquet skip the XLSX serialization for large merges
+    output_format = st.radio("Output format", list(OUTPUT_MIME_TYPES), horizontal=True)
+
     st.subheader("1. Basic Merge")
     if st.button("Extract and Merge Columns (Basic)"):
         if old_file_upload and new_file_upload:
             try:
-                old_file = pd.read_excel(old_file_upload)
-                new_file = pd.read_excel(new_file_upload)
-
                 # Convert input columns to lists
-                old_keys_list = [key.strip() for key in old_keys.split(',')]
-                new_keys_list = [key.strip() for key in new_keys.split(',')]
-                old_cols = [col.strip() for col in old_columns.split(',')]
-                new_cols = [col.strip() for col in new_columns.split(',')]
-
-                # Check if keys and columns are in the files
-                if not all(key in old_file.columns for key in old_keys_list) or not all(col in old_file.columns for col in old_cols):
-                    st.error("One or more keys/columns not found in Excel A.")
+                old_keys_list = _parse_cols(old_keys)
+                new_keys_list = _parse_cols(new_keys)
+                old_cols = _parse_cols(old_columns)
+                new_cols = _parse_cols(new_columns)
+
+                # Both files need the same, non-zero number of primary keys to pair them up
+                if not old_keys_list or not new_keys_list:
+                    st.error("Please enter at least one primary key for both Excel A and Excel B.")
                     return
-                if not all(key in new_file.columns for key in new_keys_list) or not all(col in new_file.columns for col in new_cols):
-                    st.error("One or more keys/columns not found in Excel B.")
+                if len(old_keys_list) != len(new_keys_list):
+                    st.error(f"Excel A has {len(old_keys_list)} primary keys but Excel B has {len(new_keys_list)}; they must match.")
                     return
 
-                merged_file_path = extract_and_merge_columns_basic(old_file, new_file, old_keys_list, new_keys_list, old_cols, new_cols)
+                # Check if keys and columns are in the files before reading the rows
+                old_missing = set(old_keys_list + old_cols).difference(load_xlsx_header(old_file_upload.getvalue(), old_file_upload.name))
+                if old_missing:
+                    st.error(f"Keys/columns not found in Excel A: {sorted(old_missing)}")
+                    return
+                new_missing = set(new_keys_list + new_cols).difference(load_xlsx_header(new_file_upload.getvalue(), new_file_upload.name))
+                if new_missing:
+                    st.error(f"Keys/columns not found in Excel B: {sorted(new_missing)}")
+                    return
 
-                st.write("Basic merge completed successfully.")
-                with open(merged_file_path, "rb") as f:
-                    st.download_button("Download Merged File (Basic)", f, file_name="merged_output_basic.xlsx")
+                # Read only the columns needed for the merge, reusing earlier parses
+                old_file = load_xlsx(old_file_upload.getvalue(), old_file_upload.name, old_keys_list, old_cols)
+                new_file = load_xlsx(new_file_upload.getvalue(), new_file_upload.name, new_keys_list, new_cols)
 
-                # Clean up temporary file
-                os.remove(merged_file_path)
+                merged_bytes = extract_and_merge_columns_basic(old_file, new_file, old_keys_list, new_keys_list, old_cols, new_cols, output_format)
+
+                st.write("Basic merge completed successfully.")
+                st.download_button("Download Merged File (Basic)", merged_bytes, file_name=f"merged_output_basic.{output_format}", mime=OUTPUT_MIME_TYPES[output_format])
 
             except Exception as e:
                 st.error(f"An error occurred: {e}")
@@ -171,31 +410,38 @@ def main():
     if st.button("Extract and Merge Columns (With Delay Info)"):
         if old_file_upload and new_file_upload:
             try:
-                old_file = pd.read_excel(old_file_upload)
-                new_file = pd.read_excel(new_file_upload)
-
                 # Convert input columns to lists
-                old_keys_list = [key.strip() for key in old_keys.split(',')]
-                new_keys_list = [key.strip() for key in new_keys.split(',')]
-                old_cols = [col.strip() for col in old_columns.split(',')]
-                new_cols = [col.strip() for col in new_columns.split(',')]
-
-                # Check if keys and columns are in the files
-                if not all(key in old_file.columns for key in old_keys_list) or not all(col in old_file.columns for col in old_cols):
-                    st.error("One or more keys/columns not found in Excel A.")
+                old_keys_list = _parse_cols(old_keys)
+                new_keys_list = _parse_cols(new_keys)
+                old_cols = _parse_cols(old_columns)
+                new_cols = _parse_cols(new_columns)
+
+                # Both files need the same, non-zero number of primary keys to pair them up
+                if not old_keys_list or not new_keys_list:
+                    st.error("Please enter at least one primary key for both Excel A and Excel B.")
                     return
-                if not all(key in new_file.columns for key in new_keys_list) or not all(col in new_file.columns for col in new_cols):
-                    st.error("One or more keys/columns not found in Excel B.")
+                if len(old_keys_list) != len(new_keys_list):
+                    st.error(f"Excel A has {len(old_keys_list)} primary keys but Excel B has {len(new_keys_list)}; they must match.")
                     return
 
-                merged_file_path = extract_and_merge_columns_with_delay(old_file, new_file, old_keys_list, new_keys_list, old_cols, new_cols)
+                # Check if keys and columns are in the files before reading the rows
+                old_missing = set(old_keys_list + old_cols).difference(load_xlsx_header(old_file_upload.getvalue(), old_file_upload.name))
+                if old_missing:
+                    st.error(f"Keys/columns not found in Excel A: {sorted(old_missing)}")
+                    return
+                new_missing = set(new_keys_list + new_cols).difference(load_xlsx_header(new_file_upload.getvalue(), new_file_upload.name))
+                if new_missing:
+                    st.error(f"Keys/columns not found in Excel B: {sorted(new_missing)}")
+                    return
 
-                st.write("Merge with delay columns completed successfully.")
-                with open(merged_file_path, "rb") as f:
-                    st.download_button("Download Merged File (With Delay Info)", f, file_name="merged_output_with_delay.xlsx")
+                # Read only the columns needed for the merge, reusing earlier parses
+                old_file = load_xlsx(old_file_upload.getvalue(), old_file_upload.name, old_keys_list, old_cols)
+                new_file = load_xlsx(new_file_upload.getvalue(), new_file_upload.name, new_keys_list, new_cols)
+
+                merged_bytes = extract_and_merge_columns_with_delay(old_file, new_file, old_keys_list, new_keys_list, old_cols, new_cols, output_format)
 
-                # Clean up temporary file
-                os.remove(merged_file_path)
+                st.write("Merge with delay columns completed successfully.")
+                st.download_button("Download Merged File (With Delay Info)", merged_bytes, file_name=f"merged_output_with_delay.{output_format}", mime=OUTPUT_MIME_TYPES[output_format])
 
             except Exception as e:
                 st.error(f"An error occurred: {e}")